@@ -1,12 +1,21 @@
 # kink_power_quiz.py
 # Streamlit app: Kink Power Questionnaire with fixed-per-role random order,
 # per-role state persistence, radar chart, and expandable results
+import io
 import json
 import os
 import random
+import re
+import uuid
+from operator import itemgetter
 import streamlit as st
-import matplotlib.pyplot as plt
 import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:  # optional C parser; stdlib json is the fallback
+    orjson = None
 
 # ----------------------------
 # Page setup
@@ -15,10 +24,6 @@ st.set_page_config(page_title="Kink Power Questionnaire", page_icon="🕸️", l
 st.title("Kink Power Use / Experience Questionnaire")
 st.write("Rate each statement from **1 (Strongly Disagree)** to **5 (Strongly Agree)**.")
 
-# Persistent UI flags
-if "show_results" not in st.session_state:
-    st.session_state["show_results"] = False
-
 # ----------------------------
 # Data loading
 # ----------------------------
@@ -26,8 +31,20 @@ BASE_DIR = os.path.dirname(__file__)
 QUESTIONS_PATH = os.path.join(BASE_DIR, "questions.json")
 DESCRIPTIONS_PATH = os.path.join(BASE_DIR, "power_descriptions.json")
 
-@st.cache_data(show_spinner=False)
+# cache_resource hands back the same object on every hit instead of
+# deep-hashing/copying the nested dicts the way cache_data does, which is what
+# we want for static JSON. Invariant: callers never mutate the returned data.
+if hasattr(st, "cache_resource"):
+    _static_cache = st.cache_resource(show_spinner=False)
+else:
+    # Older Streamlit: skip output hashing the equivalent way
+    _static_cache = st.cache(allow_output_mutation=True, persist=True)
+
+@_static_cache
 def load_json(path: str):
+    if orjson is not None:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
@@ -45,17 +62,67 @@ except Exception as e:
     st.stop()
 
 CATEGORIES_ORDER = ["Legitimate", "Reward", "Coercive", "Referent", "Expert", "Informational"]
+BASE_IDX = {b: i for i, b in enumerate(CATEGORIES_ORDER)}
+
+# Polar angles for the radar axes; the category count is fixed, so compute once
+_ANGLES = np.linspace(0, 2 * np.pi, len(CATEGORIES_ORDER), endpoint=False)
+_ANGLES_CLOSED = np.concatenate([_ANGLES, _ANGLES[:1]])
 
-from matching import rank_profiles  # <-- add this import
+from matching import BASES, profiles_to_matrix, rank_profiles
 
 DOM_PROFILES_PATH = os.path.join(BASE_DIR, "dominant_profiles.json")
+
+@st.cache_data(show_spinner=False)
+def build_profile_matrix(profiles_path: str):
+    """Parse the profile bank once into matrix form; reruns get a cache hit."""
+    profiles = load_json(profiles_path)["dominant_profiles"]
+    return profiles_to_matrix(profiles)
+
 try:
-    DOM_PROFILES = load_json(DOM_PROFILES_PATH)["dominant_profiles"]
+    DOM_P, DOM_NAMES, DOM_IDS = build_profile_matrix(DOM_PROFILES_PATH)
 except Exception as e:
-    DOM_PROFILES = []
+    DOM_P, DOM_NAMES, DOM_IDS = np.zeros((0, len(BASES)), dtype=np.float32), (), ()
     st.warning(f"Couldn't load dominant_profiles.json: {e}")
 
 
+# ----------------------------
+# Per-user answer persistence
+# ----------------------------
+ANSWERS_DIR = os.path.join(os.path.expanduser("~"), ".kink_quiz")
+
+# Tokens are uuid4 hex: exactly 32 lowercase hex chars. The token comes from
+# the URL, so anything else (path traversal, absolute paths) must not reach
+# _answers_path.
+_TOKEN_RE = re.compile(r"[0-9a-f]{32}")
+
+def _user_token() -> str:
+    """Stable per-user token carried in the URL, so answers survive restarts.
+    Malformed tokens are discarded and replaced with a fresh one."""
+    token = st.query_params.get("token", "")
+    if not _TOKEN_RE.fullmatch(token):
+        token = uuid.uuid4().hex
+        st.query_params["token"] = token
+    return token
+
+def _answers_path(token: str) -> str:
+    return os.path.join(ANSWERS_DIR, f"{token}.json")
+
+def load_answers(token: str) -> dict:
+    """Load saved answers for this token, or {} if none exist yet."""
+    try:
+        with open(_answers_path(token), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_answers(token: str, answers: dict) -> None:
+    """Write the per-role answer maps back to the on-disk store."""
+    os.makedirs(ANSWERS_DIR, exist_ok=True)
+    with open(_answers_path(token), "w", encoding="utf-8") as f:
+        json.dump(answers, f)
+
+USER_TOKEN = _user_token()
+
 # ----------------------------
 # Role selection
 # ----------------------------
@@ -77,90 +144,168 @@ items = QBANK[role_key]
 # Fixed random order per role (stable seeds)
 # ----------------------------
 @st.cache_data(show_spinner=False)
-def get_fixed_order_for_role(items_dict, seed: int):
-    """Return a stable shuffled list of (base, question) for this role."""
-    pairs = [(base, q) for base, qlist in items_dict.items() for q in qlist]
+def get_question_order(role_key: str, seed: int):
+    """
+    Return a stable shuffled tuple of (base, question) pairs for this role.
+    Keyed on role_key/seed only, so the cache never has to hash the question
+    bank itself; tuples keep the cached order immutable across reruns.
+    """
+    pairs = [(base, q) for base, qlist in QBANK[role_key].items() for q in qlist]
     rnd = random.Random(seed)
     rnd.shuffle(pairs)
-    return pairs
+    return tuple(pairs)
 
 seed = 42 if role_key == "dom" else 4242
-all_questions = get_fixed_order_for_role(items, seed)
+all_questions = get_question_order(role_key, seed)
 
 # ----------------------------
 # Ensure per-role answer maps exist
 # ----------------------------
+# Auto-initialise from the on-disk store the first time this session runs
 if "answers_dom" not in st.session_state:
-    st.session_state["answers_dom"] = {}
-if "answers_sub" not in st.session_state:
-    st.session_state["answers_sub"] = {}
+    saved = load_answers(USER_TOKEN)
+    st.session_state["answers_dom"] = saved.get("dom", {})
+    st.session_state["answers_sub"] = saved.get("sub", {})
 
 answers_map = st.session_state["answers_dom"] if role_key == "dom" else st.session_state["answers_sub"]
 
 # ----------------------------
 # Collect responses (no visible category titles)
 # ----------------------------
-st.markdown("### Your Responses")
-
-current_role_scores = {base: [] for base in CATEGORIES_ORDER}
-
-for i, (base, question) in enumerate(all_questions, start=1):
-    # slider key is unique per role and index in that role's fixed order
-    key = f"{role_key}-{i}"
-    default_val = int(answers_map.get(key, 3))
-    val = st.slider(question, min_value=1, max_value=5, value=default_val, key=key)
-    answers_map[key] = val
-    if base in current_role_scores:
-        current_role_scores[base].append(val)
+# The sliders live inside a form so dragging one doesn't rerun anything, and
+# the form sits in a fragment so its reruns are scoped to the questionnaire
+# block rather than the whole script. Fall back to a plain function call
+# (full reruns) on Streamlit versions without fragments.
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+_HAS_FRAGMENT = _fragment is not None
+if not _HAS_FRAGMENT:
+    _fragment = lambda f: f
 
-# Compute averages for visible role
-scores = {
-    base: (sum(vals) / len(vals)) if vals else 0
-    for base, vals in current_role_scores.items()
-}
+st.markdown("### Your Responses")
 
-# ----------------------------
-# Results controls
-# ----------------------------
-col1, col2 = st.columns([1, 1])
-with col1:
-    if st.button("Show My Results", key=f"show_results_btn_{role_key}"):
+@_fragment
+def quiz_fragment(all_questions, role_key, answers_map):
+    """Questionnaire form; on submit, snapshots widget state, persists it,
+    and escalates to a full rerun so the main-body results pick it up."""
+    with st.form(f"quiz_{role_key}", clear_on_submit=False):
+        for i, (base, question) in enumerate(all_questions, start=1):
+            # slider key is unique per role and index in that role's fixed order.
+            # Seed the widget once from the persisted answers; after that,
+            # Streamlit's own widget state is the single source of truth.
+            key = f"{role_key}-{i}"
+            if key not in st.session_state:
+                # The answers file on disk is outside our control, so coerce
+                # and clamp to the 1..5 scale instead of trusting it
+                try:
+                    default_val = int(answers_map.get(key, 3))
+                except (TypeError, ValueError):
+                    default_val = 3
+                st.session_state[key] = min(5, max(1, default_val))
+            st.slider(question, min_value=1, max_value=5, key=key)
+        submitted = st.form_submit_button("Show My Results")
+
+    if submitted:
         st.session_state["show_results"] = True
-with col2:
-    if st.button("Reset results view", key=f"reset_results_btn_{role_key}"):
-        st.session_state["show_results"] = False
+        # Snapshot widget state into the per-role answer map and persist it
+        for i in range(1, len(all_questions) + 1):
+            key = f"{role_key}-{i}"
+            answers_map[key] = int(st.session_state[key])
+        save_answers(USER_TOKEN, {
+            "dom": st.session_state["answers_dom"],
+            "sub": st.session_state["answers_sub"],
+        })
+        if _HAS_FRAGMENT:
+            # A fragment rerun stops at the fragment boundary; the results
+            # live in the main body, so ask for an app-scoped rerun.
+            try:
+                st.rerun(scope="app")
+            except TypeError:
+                # experimental_fragment-era Streamlit predates the scope
+                # parameter; there a plain rerun already covers the app
+                st.rerun()
+
+quiz_fragment(all_questions, role_key, answers_map)
 
 # ----------------------------
-# Render results
+# Radar chart
 # ----------------------------
-if st.session_state["show_results"]:
-    labels = [b for b in CATEGORIES_ORDER if b in scores]
-    values = [scores[b] for b in labels]
+# Caching rendered PNG bytes (trivially hashable) rather than a Figure object
+# also spares Streamlit from re-serializing the figure on every rerun.
+@st.cache_data(show_spinner=False)
+def radar_png(values: tuple, labels: tuple, title: str) -> bytes:
+    """Render the polar radar for a (rounded) score tuple to PNG bytes once;
+    reruns with unchanged scores reuse the cached image."""
+    # Deferred import: matplotlib costs a few hundred ms cold, so only pay
+    # for it once a user actually asks for results
+    import matplotlib.pyplot as plt
+
     # close the radar
-    values += values[:1]
-    angles = np.linspace(0, 2 * np.pi, len(labels), endpoint=False).tolist()
-    angles += angles[:1]
+    closed_values = list(values) + [values[0]]
 
     fig, ax = plt.subplots(figsize=(6, 6), subplot_kw=dict(polar=True))
     # Fixed axis & orientation
     ax.set_ylim(0, 5)
     ax.set_yticks([1, 2, 3, 4, 5])
-    ax.set_yticklabels(["1", "2", "3", "4", "5"])
     ax.set_theta_offset(np.pi / 2)   # start at 12 o'clock
     ax.set_theta_direction(-1)       # clockwise
     ax.grid(True)
 
     # Radar
-    ax.plot(angles, values, linewidth=2)
-    ax.fill(angles, values, alpha=0.25)
-    ax.set_xticks(angles[:-1])
+    ax.plot(_ANGLES_CLOSED, closed_values, linewidth=2)
+    ax.fill(_ANGLES_CLOSED, closed_values, alpha=0.25)
+    ax.set_xticks(_ANGLES)
     ax.set_xticklabels(labels)
-    ax.set_title(f"Your Power Profile – {role}", pad=20)
+    ax.set_title(title, pad=20)
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=110, bbox_inches="tight")
+    plt.close(fig)
+    return buf.getvalue()
+
+# ----------------------------
+# Render results
+# ----------------------------
+# Results stay visible across reruns (e.g. toggling the radar checkbox below);
+# the reset button hides them again. It is checked before the render gate so
+# a click takes effect within the same rerun.
+if st.session_state.get("show_results"):
+    if st.button("Reset results view", key=f"reset_results_btn_{role_key}"):
+        st.session_state["show_results"] = False
 
-    st.pyplot(fig)
+if st.session_state.get("show_results"):
+    # Per-base running totals and counts as flat int32 buffers, indexed via
+    # BASE_IDX, derived from widget state only when results are shown
+    totals = np.zeros(len(CATEGORIES_ORDER), dtype=np.int32)
+    counts = np.zeros(len(CATEGORIES_ORDER), dtype=np.int32)
+    for i, (base, question) in enumerate(all_questions, start=1):
+        bi = BASE_IDX.get(base)
+        if bi is not None:
+            totals[bi] += st.session_state[f"{role_key}-{i}"]
+            counts[bi] += 1
+
+    # Compute averages for visible role in one vector divide
+    avgs = np.where(counts > 0, totals / np.maximum(counts, 1), 0.0)
+    scores = dict(zip(CATEGORIES_ORDER, avgs.tolist()))
+
+    labels = tuple(b for b in CATEGORIES_ORDER if b in scores)
+    # round to 2 decimals so tiny float noise doesn't defeat the figure cache
+    values = tuple(round(scores[b], 2) for b in labels)
+
+    st.markdown(f"#### Your Power Profile – {role}")
+
+    # Lightweight default view: per-base metrics plus a bar chart serialize
+    # to a few hundred bytes, versus tens of KB for the radar image
+    cols = st.columns(len(labels))
+    for c, b, v in zip(cols, labels, values):
+        c.metric(b, f"{v:.1f}")
+    st.bar_chart(pd.Series(dict(zip(labels, values)), name="score"))
+
+    # The radar costs a full matplotlib render, so it is opt-in
+    if st.checkbox("Show radar", key=f"show_radar_{role_key}"):
+        st.image(radar_png(values, labels, f"Your Power Profile – {role}"))
 
     # ---- Bases of power list with click-to-expand details ----
-    ordered = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+    ordered = sorted(scores.items(), key=itemgetter(1), reverse=True)
 
     st.markdown("### Bases of Power — details")
     for base, score in ordered:
@@ -175,9 +320,9 @@ if st.session_state["show_results"]:
                 st.caption("Description not available.")
 
     # ---- Dominant stereotype matches (we'll add submissive later) ----
-    if role_key == "dom" and DOM_PROFILES:
+    if role_key == "dom" and len(DOM_P):
         st.markdown("### Dominant stereotype matches")
-        ranked = rank_profiles(scores, DOM_PROFILES)
+        ranked = rank_profiles(scores, DOM_P, DOM_NAMES, DOM_IDS)
 
         # Show top 3 prominently
         top3 = ranked[:3]
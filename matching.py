@@ -1,46 +1,107 @@
 # matching.py
 # Distance + ranking utilities for power-profile matching
 
-from math import sqrt
+import functools
+
+import numpy as np
 
 BASES = ["Legitimate", "Reward", "Coercive", "Referent", "Expert", "Informational"]
 
-def euclidean_match_percent(user_scores: dict, profile_scores: dict, weights: dict | None = None):
+def _scores_to_vector(scores: dict) -> np.ndarray:
+    """Project a base->score dict onto the fixed BASES order as a float32 vector."""
+    return np.array([float(scores.get(b, 0)) for b in BASES], dtype=np.float32)
+
+def _prepare_weights(weights: dict | None):
     """
-    Compute weighted Euclidean distance between user_scores and profile_scores (1..5 scale per base),
-    then convert it to a 0..100% match where 100% is identical.
+    Project a base->weight dict (missing bases default to 1.0) onto BASES
+    order and precompute the max-distance normalizer, so both are paid once
+    per ranking call rather than per profile.
     """
-    if weights is None:
-        weights = {}
+    if not weights:
+        W = np.ones(len(BASES), dtype=np.float32)
+    else:
+        W = np.array([float(weights.get(b, 1.0)) for b in BASES], dtype=np.float32)
+    wsum = W.sum()
+    # Max possible difference per base is 4 (from 1..5 scale)
+    dmax = 4.0 * np.sqrt(wsum) if wsum > 0 else 1.0
+    return W, dmax
 
-    acc = 0.0
-    wsum = 0.0
-    for base in BASES:
-        w = float(weights.get(base, 1.0))
-        u = float(user_scores.get(base, 0))
-        p = float(profile_scores.get(base, 0))
-        acc += w * (u - p) ** 2
-        wsum += w
+def profiles_to_matrix(profiles: list[dict]):
+    """
+    Ingest a profile list once into an (N, 6) int8 matrix plus parallel
+    name/id tuples, so ranking runs as a single vectorized pass instead of
+    per-profile dict lookups. Profile scores are always integers on the
+    1..5 scale, so int8 storage is lossless and keeps large profile banks
+    resident in L1.
+    """
+    P = np.zeros((len(profiles), len(BASES)), dtype=np.int8)
+    names = []
+    ids = []
+    for i, p in enumerate(profiles):
+        scores = p["scores"]
+        P[i] = [int(scores.get(b, 0)) for b in BASES]
+        names.append(p.get("name"))
+        ids.append(p.get("id"))
+    return P, tuple(names), tuple(ids)
 
-    d = sqrt(acc)
-    # Max possible difference per base is 4 (from 1..5 scale)
-    dmax = 4.0 * (wsum ** 0.5) if wsum > 0 else 1.0
-    match = max(0.0, 1.0 - d / dmax) * 100.0
+def _batched_match_percent(U: np.ndarray, P: np.ndarray, W: np.ndarray, dmax: float):
+    """
+    Weighted Euclidean distance from user vector U to every row of P, plus the
+    0..100% match conversion, computed as one vectorized reduction. P may be
+    the int8 quantized matrix; it is upcast against the float32 user vector,
+    which stays float because user scores are fractional per-base averages.
+    W and dmax come pre-built from _prepare_weights.
+    """
+    diff = P - U
+    d = np.sqrt((diff * diff) @ W)
+    match = np.clip(1.0 - d / dmax, 0.0, None) * 100.0
     return d, match
 
-def rank_profiles(user_scores: dict, profiles: list[dict], weights: dict | None = None, top_k: int | None = None):
+@functools.lru_cache(maxsize=256)
+def _match_core(u_tuple: tuple, p_tuple: tuple, w_tuple: tuple):
+    """Memoized scalar distance/match for hashable score tuples in BASES order."""
+    U = np.array(u_tuple, dtype=np.float32)
+    P = np.array(p_tuple, dtype=np.float32)[np.newaxis, :]
+    W, dmax = _prepare_weights(dict(zip(BASES, w_tuple)))
+    d, match = _batched_match_percent(U, P, W, dmax)
+    return float(d[0]), float(match[0])
+
+def euclidean_match_percent(user_scores: dict, profile_scores: dict, weights: dict | None = None):
+    """
+    Compute weighted Euclidean distance between user_scores and profile_scores (1..5 scale per base),
+    then convert it to a 0..100% match where 100% is identical.
+
+    Thin scalar wrapper over the memoized core: the dicts are projected onto
+    hashable tuples so repeated queries are an lru_cache lookup.
+    """
+    u_t = tuple(float(user_scores.get(b, 0)) for b in BASES)
+    p_t = tuple(float(profile_scores.get(b, 0)) for b in BASES)
+    if not weights:
+        w_t = (1.0,) * len(BASES)
+    else:
+        w_t = tuple(float(weights.get(b, 1.0)) for b in BASES)
+    return _match_core(u_t, p_t, w_t)
+
+def rank_profiles(user_scores: dict, P: np.ndarray, names: tuple, ids: tuple,
+                  weights: dict | None = None, top_k: int | None = None):
     """
     Rank profiles by match% descending.
-    Each profile is expected to have a 'name' (str) and 'scores' (dict of base->1..5).
+    Takes the matrix form produced by profiles_to_matrix, so callers can build
+    it once (and cache it) instead of re-parsing the profile list per call.
     Returns a list of dicts: {"id", "name", "match_percent"} sorted desc.
     """
-    results = []
-    for p in profiles:
-        _, m = euclidean_match_percent(user_scores, p["scores"], weights)
-        results.append({
-            "id": p.get("id"),
-            "name": p.get("name"),
-            "match_percent": round(m, 1)
-        })
-    results.sort(key=lambda r: r["match_percent"], reverse=True)
-    return results[:top_k] if top_k else results
+    if not len(P):
+        return []
+    U = _scores_to_vector(user_scores)
+    W, dmax = _prepare_weights(weights)
+    _, match = _batched_match_percent(U, P, W, dmax)
+    if top_k and top_k < len(match):
+        # O(N) partial selection of the top_k rows, then sort only those
+        idx = np.argpartition(-match, top_k)[:top_k]
+        order = idx[np.argsort(-match[idx])]
+    else:
+        order = np.argsort(-match)
+    return [
+        {"id": ids[i], "name": names[i], "match_percent": round(float(match[i]), 1)}
+        for i in order
+    ]